@@ -3,19 +3,69 @@
 Page watcher with WhatsApp and Gmail notifications.
 Monitors a web page for changes based on keywords or CSS selectors.
 """
+import atexit
+import codecs
 import hashlib
 import json
 import os
+import random
+import re
 import smtplib
+import struct
 import sys
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from email.message import EmailMessage
+from functools import lru_cache
 
+import ahocorasick
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
+from bs4.dammit import EncodingDetector
+from lxml import etree
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # Optional: faster state serialization
+    orjson = None
 
 STATE_PATH = "state/page_state.json"
+HOT_STATE_PATH = "state/page_state.bin"
+HASH_ALGO = "blake2b-64"
+
+# Retry backoff: full jitter over BASE * 2**attempt, capped at CAP seconds
+RETRY_BASE = 0.2
+RETRY_CAP = 8.0
+
+# Hot state rewritten on every run: signal hash, check time, raw body hash,
+# raw body length (-1 if unknown), signal settings fingerprint, then the
+# byte lengths of the ETag and Last-Modified values that follow the header
+_HOT = struct.Struct("<Q d Q q Q H H")
+_state_dir_ready = False
+
+# Response bodies are streamed in chunks of this size
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def _make_session() -> requests.Session:
+    """Build the HTTP session shared by page fetches and Twilio calls."""
+    session = requests.Session()
+    session.headers["User-Agent"] = "Mozilla/5.0 (compatible; PageWatcher/1.0; +https://github.com/)"
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Reused connections avoid a fresh TCP + TLS handshake on every request
+_HTTP = _make_session()
+atexit.register(_HTTP.close)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_LONG_NUMBER_RE = re.compile(r"\b\d{7,}\b")
 
 
 def now_utc_iso() -> str:
@@ -23,98 +73,306 @@ def now_utc_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def _ensure_state_dir():
+    """Create the state directory (once per process)."""
+    global _state_dir_ready
+    if not _state_dir_ready:
+        os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+        _state_dir_ready = True
+
+
+def _pack_header(value: str | None) -> bytes:
+    """Encode a header value for the hot record's variable-length tail."""
+    return (value or "").encode("latin-1", errors="replace")
+
+
+def _parse_hot_record(raw: bytes) -> dict | None:
+    """Decode the hot binary record into state fields, or None if it is invalid."""
+    try:
+        header = _HOT.unpack_from(raw)
+        last_hash, last_checked, body_hash, body_length, signal_config, etag_len, lm_len = header
+        if len(raw) != _HOT.size + etag_len + lm_len:
+            return None
+        tail = raw[_HOT.size:].decode("latin-1")
+        hot = {
+            "last_checked": datetime.fromtimestamp(last_checked, timezone.utc).isoformat(),
+            "etag": tail[:etag_len] or None,
+            "last_modified": tail[etag_len:] or None,
+            "last_body_hash": f"{body_hash:016x}" if body_hash else None,
+            "last_content_length": body_length if body_length >= 0 else None,
+            "signal_config": f"{signal_config:016x}" if signal_config else None,
+        }
+    except (struct.error, ValueError, OverflowError, OSError):
+        return None
+    if last_hash:
+        hot["last_hash"] = f"{last_hash:016x}"
+        hot["hash_algo"] = HASH_ALGO
+    return hot
+
+
 def load_state():
-    """Load previous state from JSON file."""
-    if not os.path.exists(STATE_PATH):
-        return {"last_hash": None, "last_match": None, "last_checked": None}
+    """Load previous state from the JSON file, overlaid with the hot binary record."""
+    state = {"last_hash": None, "last_match": None, "last_checked": None}
+    if os.path.exists(STATE_PATH):
+        try:
+            with open(STATE_PATH, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Could not load state: {e}", file=sys.stderr)
+
+    # Baselines hashed with a different algorithm can't be compared;
+    # drop them so the next run silently re-baselines
+    if state.get("hash_algo") != HASH_ALGO:
+        state["last_hash"] = None
+
+    # The hot record is written on every run, so it is newer than the JSON
     try:
-        with open(STATE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
-        print(f"Warning: Could not load state: {e}", file=sys.stderr)
-        return {"last_hash": None, "last_match": None, "last_checked": None}
+        with open(HOT_STATE_PATH, "rb") as f:
+            raw = f.read()
+    except IOError:
+        raw = b""
+    hot = _parse_hot_record(raw) if raw else None
+    if hot is not None:
+        state.update(hot)
+    elif raw:
+        print("Warning: Ignoring unrecognized hot state record", file=sys.stderr)
+
+    return state
 
 
 def save_state(state):
-    """Save current state to JSON file."""
-    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
-    with open(STATE_PATH, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    """
+    Save current state (including the human-readable summary) to JSON file.
+
+    Written compactly to a temporary file and renamed into place, so a
+    crash mid-write can't corrupt the existing baseline.
+    """
+    _ensure_state_dir()
+    if orjson is not None:
+        data = orjson.dumps(state)
+    else:
+        data = json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def save_state_hot(state):
+    """Save the per-run state to the compact binary record with a single write."""
+    _ensure_state_dir()
+    etag = _pack_header(state.get("etag"))
+    last_modified = _pack_header(state.get("last_modified"))
+    record = _HOT.pack(
+        int(state.get("last_hash") or "0", 16),
+        datetime.fromisoformat(state["last_checked"]).timestamp(),
+        int(state.get("last_body_hash") or "0", 16),
+        state["last_content_length"] if state.get("last_content_length") is not None else -1,
+        int(state.get("signal_config") or "0", 16),
+        len(etag),
+        len(last_modified),
+    ) + etag + last_modified
+    fd = os.open(HOT_STATE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, record)
+    finally:
+        os.close(fd)
 
 
-def sha256(s: str) -> str:
-    """Generate SHA-256 hash of a string."""
-    return hashlib.sha256(s.encode("utf-8", errors="ignore")).hexdigest()
+def content_fingerprint(s: str) -> str:
+    """
+    Generate a short BLAKE2b fingerprint of a string.
+
+    Only used for change detection, so a 64-bit digest is plenty and
+    much cheaper to compute than SHA-256.
+    """
+    return hashlib.blake2b(s.encode("utf-8", errors="ignore"), digest_size=8).hexdigest()
 
 
-def fetch(url: str, retries: int = 3) -> str:
+def _canonicalize(text: str) -> str:
     """
-    Fetch a URL with retry logic.
+    Normalize text before hashing to avoid false-positive change alerts.
+
+    Drops long digit runs (timestamps, session/ad IDs, nonces) and
+    collapses whitespace jitter.
+    """
+    text = _LONG_NUMBER_RE.sub("", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def _retry_wait(attempt: int, response: requests.Response | None) -> float | None:
+    """
+    Pick how long to wait before the next fetch attempt.
+
+    Honors a numeric Retry-After header when present. Returns None for
+    client errors that a retry cannot fix (4xx other than 408/429).
+    """
+    if response is not None:
+        status = response.status_code
+        if 400 <= status < 500 and status not in (408, 429):
+            return None
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(RETRY_CAP, float(retry_after))
+    return min(RETRY_CAP, RETRY_BASE * 2 ** attempt) * random.random()
+
+
+def fetch(url: str, state: dict, retries: int = 3) -> tuple[bytes, str | None, str] | None:
+    """
+    Fetch a URL with retry logic, using HTTP conditional requests.
+
+    If a baseline exists and the server previously sent an ETag or
+    Last-Modified header, they are sent back as If-None-Match /
+    If-Modified-Since so an unchanged page costs no body transfer.
+    Validators from a successful response are stored back into state.
+
+    The body is streamed and kept as raw bytes; the HTML parser decodes it
+    (see _resolve_encoding()) instead of requests materializing a second,
+    decoded copy. The raw bytes are fingerprinted in the same pass.
 
     Args:
         url: URL to fetch
+        state: Current watcher state (read and updated in place)
         retries: Number of retry attempts
 
     Returns:
-        HTML content as string
+        Tuple of (body_bytes, charset_from_headers_or_None, body_fingerprint),
+        or None if the server answered 304 Not Modified
 
     Raises:
-        requests.exceptions.RequestException: If all retries fail
+        requests.exceptions.RequestException: If all retries fail, or immediately
+            on a client error that retrying cannot fix
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; PageWatcher/1.0; +https://github.com/)"
-    }
+    headers = {}
+    # Without a baseline a 304 would leave us nothing to compare against
+    if state.get("last_hash"):
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
 
     for attempt in range(retries):
         try:
             print(f"Fetching {url} (attempt {attempt + 1}/{retries})...")
-            r = requests.get(url, headers=headers, timeout=30)
-            r.raise_for_status()
-            print(f"✓ Fetched successfully ({len(r.text)} bytes)")
-            return r.text
+            with _HTTP.get(url, headers=headers, timeout=30, stream=True) as r:
+                if r.status_code == 304:
+                    print("✓ Not modified since last check (304)")
+                    return None
+                r.raise_for_status()
+                chunks = []
+                body_hash = hashlib.blake2b(digest_size=8)
+                for chunk in r.iter_content(READ_CHUNK_SIZE):
+                    body_hash.update(chunk)
+                    chunks.append(chunk)
+                body = b"".join(chunks)
+                # Only trust an explicit charset; otherwise it is resolved from the body
+                has_charset = "charset" in r.headers.get("Content-Type", "").lower()
+                encoding = r.encoding if has_charset else None
+                print(f"✓ Fetched successfully ({len(body)} bytes)")
+                state["etag"] = r.headers.get("ETag")
+                state["last_modified"] = r.headers.get("Last-Modified")
+                return body, encoding, body_hash.hexdigest()
         except requests.exceptions.RequestException as e:
-            if attempt == retries - 1:
+            wait_time = _retry_wait(attempt, e.response)
+            if attempt == retries - 1 or wait_time is None:
                 raise
-            wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
-            print(f"✗ Fetch failed: {e}. Retrying in {wait_time}s...", file=sys.stderr)
+            print(f"✗ Fetch failed: {e}. Retrying in {wait_time:.2f}s...", file=sys.stderr)
             time.sleep(wait_time)
 
-    return ""  # Should never reach here
+    return b"", None, ""  # Should never reach here
 
 
-def extract_signal(html: str, selector: str | None, keywords: list[str] | None) -> tuple[str, str, dict]:
+# Tags whose text BeautifulSoup's get_text() leaves out
+_HIDDEN_TEXT_TAGS = frozenset({"script", "style", "template", "rt", "rp"})
+
+
+def _visible_strings(root):
+    """Yield the text nodes under root in document order, skipping hidden subtrees."""
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            yield item
+            continue
+        # Pushed in reverse: text, then children, then tail come off the stack
+        if item.tail and item is not root:
+            stack.append(item.tail)
+        # Comments and processing instructions have non-string tags
+        if isinstance(item.tag, str) and item.tag not in _HIDDEN_TEXT_TAGS:
+            stack.extend(reversed(item))
+            if item.text:
+                stack.append(item.text)
+
+
+def _page_text(html: bytes | str, encoding: str | None = None) -> str:
     """
-    Extract the signal to monitor from HTML content.
+    Extract visible page text with lxml, without building a BeautifulSoup tree.
 
-    Args:
-        html: HTML content
-        selector: Optional CSS selector to target
-        keywords: Optional list of keywords to look for
+    Mirrors BeautifulSoup's get_text(" ", strip=True): script, style,
+    template and ruby annotation (rt/rp) contents and comments are skipped,
+    remaining strings are stripped and joined with single spaces.
+    """
+    try:
+        parser = lxml.html.HTMLParser(encoding=encoding)
+    except LookupError:
+        parser = lxml.html.HTMLParser()  # Unknown charset in headers
+    try:
+        doc = lxml.html.document_fromstring(html, parser=parser)
+    except etree.ParserError:
+        return ""  # Empty document
+    return " ".join(t.strip() for t in _visible_strings(doc) if t.strip())
 
-    Returns:
-        Tuple of (signal_text, human_summary, metadata_dict)
-        signal_text is hashed to detect changes
+
+@lru_cache(maxsize=None)
+def _keyword_automaton(keywords: tuple[str, ...]) -> ahocorasick.Automaton:
+    """Build (once per keyword set) an Aho-Corasick automaton over casefolded keywords."""
+    automaton = ahocorasick.Automaton()
+    for kw in keywords:
+        automaton.add_word(kw.casefold(), kw.casefold())
+    automaton.make_automaton()
+    return automaton
+
+
+def _find_keywords(page_text: str, keywords: tuple[str, ...]) -> set[str]:
     """
-    soup = BeautifulSoup(html, "lxml")
+    Return the casefolded keywords that occur in page_text.
 
-    # Option B: CSS selector-based (precise targeting)
-    if selector:
-        el = soup.select_one(selector)
-        text = el.get_text(" ", strip=True) if el else ""
-        summary = f"Selector '{selector}' matched: '{text[:150]}...'" if text else f"Selector '{selector}' not found"
-        metadata = {"method": "selector", "selector": selector, "found": bool(text), "length": len(text)}
-        return text, summary, metadata
+    The text is casefolded one window at a time rather than as a full-size
+    copy; windows overlap by the longest keyword so boundary matches aren't lost.
+    """
+    automaton = _keyword_automaton(keywords)
+    overlap = max(len(kw.casefold()) for kw in keywords) - 1
+    found = set()
+    for start in range(0, len(page_text), READ_CHUNK_SIZE):
+        window = page_text[start:start + READ_CHUNK_SIZE + overlap].casefold()
+        found.update(folded for _, folded in automaton.iter(window))
+    return found
+
+
+def _extract_by_selector(html: bytes | str, encoding: str | None, selector: str) -> tuple[str, str, dict]:
+    """Extract the text of the first element matching a CSS selector."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "lxml", from_encoding=encoding)
+    el = soup.select_one(selector)
+    text = el.get_text(" ", strip=True) if el else ""
+    summary = f"Selector '{selector}' matched: '{text[:150]}...'" if text else f"Selector '{selector}' not found"
+    metadata = {"method": "selector", "selector": selector, "found": bool(text), "length": len(text)}
+    return text, summary, metadata
 
-    # Option A: Keyword-based (robust against page structure changes)
-    page_text = soup.get_text(" ", strip=True)
-    page_text_lower = page_text.lower()
+
+def _extract_by_keywords(
+    html: bytes | str, encoding: str | None, keywords: list[str] | None
+) -> tuple[str, str, dict]:
+    """Extract the full page text and the keywords found in it."""
+    page_text = _page_text(html, encoding)
 
     matches = []
-    if keywords:
-        for kw in keywords:
-            kw_clean = kw.strip()
-            if kw_clean and kw_clean.lower() in page_text_lower:
-                matches.append(kw_clean)
+    keywords_clean = tuple(kw.strip() for kw in keywords or () if kw.strip())
+    if keywords_clean:
+        # Single linear pass over the page for all keywords at once
+        found = _find_keywords(page_text, keywords_clean)
+        matches = [kw for kw in keywords_clean if kw.casefold() in found]
 
     # Important: Use full page content as signal to detect ANY change
     # This prevents false negatives (missing real changes)
@@ -137,6 +395,66 @@ def extract_signal(html: str, selector: str | None, keywords: list[str] | None)
     return signal, summary, metadata
 
 
+def _known_codec(name: str) -> bool:
+    """Return True if Python recognizes the charset name."""
+    try:
+        codecs.lookup(name)
+        return True
+    except LookupError:
+        return False
+
+
+def _resolve_encoding(html: bytes, encoding: str | None) -> tuple[bytes, str]:
+    """
+    Pick the charset for a raw page body, so both extraction paths decode it alike.
+
+    An explicit charset from the headers wins; then a BOM or a recognized
+    <meta> declaration; then UTF-8 if the body is valid UTF-8; otherwise
+    Windows-1252.
+
+    Returns:
+        Tuple of (body_without_bom, encoding)
+    """
+    if encoding:
+        return html, encoding
+    html, bom_encoding = EncodingDetector.strip_byte_order_mark(html)
+    declared = bom_encoding or EncodingDetector.find_declared_encoding(html, is_html=True)
+    if declared and _known_codec(declared):
+        return html, declared
+    try:
+        html.decode("utf-8")
+        return html, "utf-8"
+    except UnicodeDecodeError:
+        return html, "windows-1252"
+
+
+def extract_signal(
+    html: bytes | str, selector: str | None, keywords: list[str] | None, encoding: str | None = None
+) -> tuple[str, str, dict]:
+    """
+    Extract the signal to monitor from HTML content.
+
+    Args:
+        html: HTML content (raw bytes or decoded string)
+        selector: Optional CSS selector to target
+        keywords: Optional list of keywords to look for
+        encoding: Optional charset for raw bytes (resolved from the body if omitted)
+
+    Returns:
+        Tuple of (signal_text, human_summary, metadata_dict)
+        signal_text is hashed to detect changes
+    """
+    if isinstance(html, bytes):
+        html, encoding = _resolve_encoding(html, encoding)
+
+    # Option B: CSS selector-based (precise targeting)
+    if selector:
+        return _extract_by_selector(html, encoding, selector)
+
+    # Option A: Keyword-based (robust against page structure changes)
+    return _extract_by_keywords(html, encoding, keywords)
+
+
 def send_email(subject: str, body: str) -> bool:
     """
     Send email notification via SMTP.
@@ -195,13 +513,7 @@ def send_whatsapp(subject: str, body: str) -> bool:
     recipients = [num.strip() for num in w_to_raw.split(",") if num.strip()]
 
     try:
-        import base64
-
-        auth = base64.b64encode(f"{sid}:{token}".encode()).decode()
         url = f"https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json"
-        headers = {
-            "Authorization": f"Basic {auth}",
-        }
 
         success_count = 0
         for w_to in recipients:
@@ -211,7 +523,7 @@ def send_whatsapp(subject: str, body: str) -> bool:
                     "To": w_to,
                     "Body": f"{subject}\n\n{body}",
                 }
-                r = requests.post(url, data=data, headers=headers, timeout=30)
+                r = _HTTP.post(url, data=data, auth=(sid, token), timeout=30)
                 r.raise_for_status()
                 print(f"✓ WhatsApp sent to {w_to}")
                 success_count += 1
@@ -245,9 +557,11 @@ def send_notifications(url: str, state: dict, metadata: dict):
     print(body)
     print("=" * 60 + "\n")
 
-    # Send via all configured channels
-    email_sent = send_email(subject, body)
-    whatsapp_sent = send_whatsapp(subject, body)
+    # Send via all configured channels concurrently (both are network-bound)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        email_future = ex.submit(send_email, subject, body)
+        whatsapp_future = ex.submit(send_whatsapp, subject, body)
+        email_sent, whatsapp_sent = email_future.result(), whatsapp_future.result()
 
     if not email_sent and not whatsapp_sent:
         print("⚠ Warning: No notifications were sent (check your configuration)", file=sys.stderr)
@@ -271,6 +585,8 @@ def main():
             sys.exit(2)
 
         force_notify = os.getenv("FORCE_NOTIFY", "").lower() == "true"
+        normalize = os.getenv("WATCH_NORMALIZE", "") == "1"
+        fast_path = os.getenv("WATCH_FAST_PATH", "1") != "0"
 
         print(f"\n{'=' * 60}")
         print(f"Page Watcher - {now_utc_iso()}")
@@ -295,20 +611,55 @@ def main():
         # Load previous state
         state = load_state()
 
+        # A baseline hashed under a different selector/normalization can't be
+        # compared (nor trusted via 304 or the fast path) - silently re-baseline
+        signal_config = content_fingerprint(f"{selector or ''}\0{int(normalize)}")
+        if state.get("signal_config") != signal_config:
+            state["last_hash"] = None
+        state["signal_config"] = signal_config
+
         # Fetch current page
-        html = fetch(url)
+        page = fetch(url, state)
+
+        # Server confirmed nothing changed - skip parsing and hashing
+        if page is None:
+            state["last_checked"] = now_utc_iso()
+            save_state_hot(state)
+            print("✓ No change detected")
+            return
+
+        html, encoding, body_hash = page
+
+        # Byte-identical body - skip parsing entirely
+        if (
+            fast_path
+            and state.get("last_hash")
+            and len(html) == state.get("last_content_length")
+            and body_hash == state.get("last_body_hash")
+        ):
+            state["last_checked"] = now_utc_iso()
+            save_state_hot(state)
+            print("✓ No change detected (page body identical to last check)")
+            return
+
+        state["last_content_length"] = len(html)
+        state["last_body_hash"] = body_hash
 
         # Extract signal
-        signal_text, summary, metadata = extract_signal(html, selector, keywords)
-        current_hash = sha256(signal_text)
+        signal_text, summary, metadata = extract_signal(html, selector, keywords, encoding)
+        if normalize:
+            signal_text = _canonicalize(signal_text)
+        current_hash = content_fingerprint(signal_text)
 
         # Update state
         state["last_checked"] = now_utc_iso()
+        state["hash_algo"] = HASH_ALGO
 
         # Check if this is first run
         if state.get("last_hash") is None:
             state["last_hash"] = current_hash
             state["last_match"] = summary
+            save_state_hot(state)
             save_state(state)
             print("✓ Baseline established (first run)")
             print(f"  {summary}")
@@ -321,16 +672,18 @@ def main():
             # Page changed - send notifications
             send_notifications(url, state, metadata)
 
-            # Update state after detecting change
+            # Update state after detecting change. The hot record goes
+            # first: load_state() trusts it over the JSON, so a crash in
+            # between must not leave it holding the old hash
             state["last_hash"] = current_hash
             state["last_match"] = summary
+            save_state_hot(state)
             save_state(state)
         else:
-            # No change
+            # No change - only the hot record needs refreshing
             print("✓ No change detected")
             print(f"  {summary}")
-            state["last_match"] = summary
-            save_state(state)
+            save_state_hot(state)
 
     except requests.exceptions.RequestException as e:
         print(f"\n✗ Network error: {e}", file=sys.stderr)
@@ -344,7 +697,6 @@ def main():
 
     except Exception as e:
         print(f"\n✗ Unexpected error: {e}", file=sys.stderr)
-        import traceback
         traceback.print_exc()
         sys.exit(1)
 